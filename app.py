@@ -1,40 +1,86 @@
 from __future__ import annotations
 
-import plotly.express as px
 import streamlit as st
 
 from core.auth import authenticate, init_auth_state
-from core.data_service import get_placeholder_interactions, load_datasets
-from core.formatters import format_currency, safe_percentage
+from core.data_service import (
+    clear_snapshot,
+    get_placeholder_interactions,
+    load_datasets,
+    load_home_kpis,
+)
 from core.ui import chart_card, inject_global_styles, style_fig
 from services.logging_service import get_logger
 
 st.set_page_config(page_title="Painel de BI Operacional", layout="wide")
 
+_HERO_HTML: str = """
+<div class="hero">
+    <div class="hero-text">
+        <p class="eyebrow">BI Operacional</p>
+        <h1>Radar Estratégico B2</h1>
+        <p>Use as páginas ao lado para navegar entre visão consolidada e análise detalhada.</p>
+    </div>
+    <div class="hero-stats">
+        <div>
+            <span>Versão</span>
+            <strong>2.0</strong>
+            <small>Arquitetura modular</small>
+        </div>
+        <div>
+            <span>Telas</span>
+            <strong>2 principais</strong>
+            <small>Painel Geral & Relatório</small>
+        </div>
+    </div>
+</div>
+"""
+
+_NAV_MARKDOWN: str = """
+1. **Painel Geral**: KPIs consolidados, filtros avançados e Modo Apresentação.
+2. **Relatório de Oportunidade**: consulta individual com IA opcional para insights.
+"""
+
 
-def ensure_datasets():
-    if "datasets" not in st.session_state:
-        st.session_state["datasets"] = load_datasets()
-    return st.session_state["datasets"]
+class _DatasetHandle:
+    """Lazy access to the cached datasets; pages that never read `value` pay no load cost."""
+
+    @property
+    def value(self):
+        if "datasets" not in st.session_state:
+            st.session_state["datasets"] = load_datasets()
+            st.session_state["home_kpis"] = load_home_kpis(st.session_state["datasets"][0])
+        return st.session_state["datasets"]
+
+
+datasets = _DatasetHandle()
 
 
 def render_sidebar():
-    st.sidebar.title("Status de Acesso")
-    if st.session_state.get("authenticated"):
-        st.sidebar.success("Usuário autenticado")
-        st.sidebar.divider()
-        if st.sidebar.button("🔄 Atualizar Dados", use_container_width=True):
-            st.cache_data.clear()
-            st.cache_resource.clear()
-            if "datasets" in st.session_state:
-                del st.session_state["datasets"]
-            st.success("Cache limpo! Os dados serão recarregados.")
-            st.rerun()
-        if st.sidebar.button("Sair", use_container_width=True):
-            st.session_state.clear()
-            st.rerun()
-    else:
-        st.sidebar.info("Realize o login na tela principal.")
+    with st.sidebar:
+        st.title("Status de Acesso")
+        if st.session_state.get("authenticated"):
+            st.success("Usuário autenticado")
+            st.divider()
+            if st.button("🔄 Atualizar Dados", use_container_width=True):
+                clear_snapshot()
+                st.cache_data.clear()
+                for key in ("datasets", "home_kpis"):
+                    if key in st.session_state:
+                        del st.session_state[key]
+                st.success("Cache limpo! Os dados serão recarregados.")
+                st.rerun()
+            if st.button("🔁 Reiniciar sessão", use_container_width=True):
+                clear_snapshot()
+                st.cache_data.clear()
+                st.cache_resource.clear()
+                st.session_state.clear()
+                st.rerun()
+            if st.button("Sair", use_container_width=True):
+                st.session_state.clear()
+                st.rerun()
+        else:
+            st.info("Realize o login na tela principal.")
 
 
 def render_login(logger):
@@ -51,7 +97,7 @@ def render_login(logger):
         if submit:
             if authenticate(username, password):
                 st.session_state["authenticated"] = True
-                ensure_datasets()
+                datasets.value  # prefetch so the home panel opens with data ready
                 logger.info("Login bem-sucedido para %s", username)
                 st.success("Login realizado! Utilize o menu lateral para navegar.")
                 st.rerun()
@@ -60,78 +106,57 @@ def render_login(logger):
                 st.error("Credenciais inválidas.")
 
 
-def render_home():
-    df, _ = st.session_state.get("datasets", (None, None))
-    placeholder_interactions = get_placeholder_interactions()
+@st.cache_resource(show_spinner=False)
+def _placeholder_bar_fig():
+    import plotly.express as px
+    import plotly.graph_objects as go
 
-    st.markdown(
-        """
-        <div class="hero">
-            <div class="hero-text">
-                <p class="eyebrow">BI Operacional</p>
-                <h1>Radar Estratégico B2</h1>
-                <p>Use as páginas ao lado para navegar entre visão consolidada e análise detalhada.</p>
-            </div>
-            <div class="hero-stats">
-                <div>
-                    <span>Versão</span>
-                    <strong>2.0</strong>
-                    <small>Arquitetura modular</small>
-                </div>
-                <div>
-                    <span>Telas</span>
-                    <strong>2 principais</strong>
-                    <small>Painel Geral & Relatório</small>
-                </div>
-            </div>
-        </div>
-        """,
-        unsafe_allow_html=True,
+    # A single go.Bar trace does not stack duplicate categories the way the
+    # old px.bar(color=...) did, so aggregate per user before plotting.
+    totals = (
+        get_placeholder_interactions()
+        .groupby("Usuário", sort=False)["Interações"]
+        .sum()
+    )
+    colors = px.colors.qualitative.Plotly
+    fig = go.Figure(
+        go.Bar(
+            x=totals.index.to_numpy(),
+            y=totals.to_numpy(),
+            marker_color=[colors[i % len(colors)] for i in range(len(totals))],
+        )
+    )
+    fig.update_layout(
+        xaxis_title="Usuário", yaxis_title="Total de Interações", showlegend=False
     )
+    style_fig(fig)
+    return fig
+
+
+def render_home():
+    df, _ = datasets.value
+
+    st.markdown(_HERO_HTML, unsafe_allow_html=True)
 
     st.subheader("Como navegar?")
-    st.markdown(
-        """
-        1. **Painel Geral**: KPIs consolidados, filtros avançados e Modo Apresentação.
-        2. **Relatório de Oportunidade**: consulta individual com IA opcional para insights.
-        """
-    )
+    st.markdown(_NAV_MARKDOWN)
+
+    if df is None or df.empty:
+        st.info("Os dados serão carregados automaticamente após o primeiro login.")
+        return
+
+    kpis = st.session_state.get("home_kpis") or load_home_kpis(df)
+
+    st.markdown("### Painel em números (última carga)")
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Oportunidades Únicas", kpis["total_ops_str"])
+    col2.metric("Valor Total", kpis["total_valor_str"])
+    col3.metric("Taxa de Sucesso", kpis["win_rate_str"])
 
     with chart_card("Interações de Exemplo por Usuário"):
-        fig = px.bar(
-            placeholder_interactions,
-            x="Usuário",
-            y="Interações",
-            color="Usuário",
-            color_discrete_sequence=px.colors.qualitative.Plotly,
+        st.plotly_chart(
+            _placeholder_bar_fig(), use_container_width=True, config={"displaylogo": False}
         )
-        fig.update_layout(xaxis_title="Usuário", yaxis_title="Total de Interações")
-        style_fig(fig)
-        st.plotly_chart(fig, use_container_width=True, config={"displaylogo": False})
-
-    if df is not None and not df.empty:
-        total_ops = df['OC_Identifier'].nunique()
-        total_valor = format_currency(df['Valor'].sum(min_count=1))
-        win_rate = safe_percentage(
-            (df[df['Estado'] == 'Ganha']['OC_Identifier'].nunique() / total_ops * 100)
-            if total_ops
-            else 0
-        )
-
-        st.markdown("### Painel em números (última carga)")
-        col1, col2, col3 = st.columns(3)
-        for col, label, value in [
-            (col1, "Oportunidades Únicas", f"{int(total_ops)}"),
-            (col2, "Valor Total", total_valor),
-            (col3, "Taxa de Sucesso", win_rate),
-        ]:
-            with col:
-                st.markdown(
-                    f"<div class='metric-card'><h3>{label}</h3><p>{value}</p></div>",
-                    unsafe_allow_html=True,
-                )
-    else:
-        st.info("Os dados serão carregados automaticamente após o primeiro login.")
 
 
 def main():
@@ -141,7 +166,6 @@ def main():
     render_sidebar()
 
     if st.session_state.get("authenticated"):
-        ensure_datasets()
         render_home()
     else:
         render_login(logger)
@@ -1,15 +1,23 @@
 from __future__ import annotations
 
 import re
+import time
 from datetime import datetime
+from pathlib import Path
 from typing import Tuple
 
 import gspread
+import numpy as np
 import pandas as pd
 import streamlit as st
 from oauth2client.service_account import ServiceAccountCredentials
 
-from core.formatters import format_time_in_stage, normalize_currency
+from core.formatters import (
+    format_currency,
+    format_time_in_stage_bulk,
+    normalize_currency,
+    safe_percentage,
+)
 
 
 @st.cache_resource
@@ -27,33 +35,93 @@ def get_gspread_client():
         return None
 
 
-def _extract_oc_identifier(title: str | None) -> str | None:
-    if not isinstance(title, str):
+@st.cache_resource
+def get_spreadsheet():
+    client = get_gspread_client()
+    if client is None:
+        return None
+    return client.open("BI_B2")
+
+
+@st.cache_resource
+def get_worksheet():
+    """First worksheet handle; resolving .sheet1 costs a metadata round-trip."""
+    spreadsheet = get_spreadsheet()
+    if spreadsheet is None:
+        return None
+    return spreadsheet.sheet1
+
+
+_OC_PATTERN = re.compile(r'(OC\s*\d+|CTE\s*\d+)', re.IGNORECASE)
+
+_SNAPSHOT_DIR = Path("cache")
+_SNAPSHOT_TTL_SECONDS = 900
+_SNAPSHOT_FILES = {
+    "df": _SNAPSHOT_DIR / "bi_b2.parquet",
+    "timeline": _SNAPSHOT_DIR / "bi_b2_timeline.parquet",
+}
+
+
+def clear_snapshot() -> None:
+    for path in _SNAPSHOT_FILES.values():
+        path.unlink(missing_ok=True)
+
+
+def _read_snapshot() -> Tuple[pd.DataFrame, pd.DataFrame] | None:
+    try:
+        for path in _SNAPSHOT_FILES.values():
+            if not path.exists() or time.time() - path.stat().st_mtime > _SNAPSHOT_TTL_SECONDS:
+                return None
+        return (
+            pd.read_parquet(_SNAPSHOT_FILES["df"]),
+            pd.read_parquet(_SNAPSHOT_FILES["timeline"]),
+        )
+    except Exception:  # pragma: no cover - corrupt snapshot falls back to the Sheets path
         return None
-    match = re.search(r'(OC\s*\d+)', title, re.IGNORECASE)
-    if match:
-        return match.group(1).replace(" ", "")
-    match_cte = re.search(r'(CTE\s*\d+)', title, re.IGNORECASE)
-    if match_cte:
-        return match_cte.group(1).replace(" ", "")
-    return None
+
+
+def _write_snapshot(df: pd.DataFrame, df_timeline: pd.DataFrame) -> None:
+    try:
+        _SNAPSHOT_DIR.mkdir(exist_ok=True)
+        for key, frame in (("df", df), ("timeline", df_timeline)):
+            # Write to a sibling temp file and rename so a concurrent reader
+            # never sees a half-written parquet.
+            target = _SNAPSHOT_FILES[key]
+            tmp = target.with_suffix(".tmp")
+            frame.to_parquet(tmp)
+            tmp.replace(target)
+    except Exception:  # pragma: no cover - snapshot is best-effort only
+        pass
 
 
 @st.cache_data(ttl=900)
 def load_datasets() -> Tuple[pd.DataFrame, pd.DataFrame]:
-    client = get_gspread_client()
-    if client is None:
+    snapshot = _read_snapshot()
+    if snapshot is not None:
+        return snapshot
+
+    spreadsheet = get_spreadsheet()
+    worksheet = get_worksheet()
+    if spreadsheet is None or worksheet is None:
         return pd.DataFrame(), pd.DataFrame()
 
     try:
-        sheet = client.open("BI_B2").sheet1
-        all_data = sheet.get_all_values()
-        df = pd.DataFrame(all_data[1:], columns=all_data[0])
+        response = spreadsheet.values_get(worksheet.title)
+        all_data = response.get('values', [])
+        if not all_data:
+            return pd.DataFrame(), pd.DataFrame()
+        header = all_data[0]
+        # values_get returns ragged rows (trailing empty cells omitted), and the
+        # header itself can be trimmed short; pad and truncate every row to the
+        # header width before building the frame.
+        width = len(header)
+        rows = [(row + [''] * width)[:width] for row in all_data[1:]]
+        df = pd.DataFrame(rows, columns=header)
 
         value_cols = ['Valor', 'Valor Rec.', 'Valor fechamento', 'Valor rec. fechamento']
         for col in value_cols:
             if col in df.columns:
-                df[col] = normalize_currency(df[col])
+                df[col] = normalize_currency(df[col]).astype('float32')
 
         if 'Prob %' in df.columns:
             df['Prob %'] = (
@@ -63,41 +131,221 @@ def load_datasets() -> Tuple[pd.DataFrame, pd.DataFrame]:
                 .str.replace(',', '.', regex=False)
                 .str.replace(' ', '', regex=False)
             )
-            df['Prob %'] = pd.to_numeric(df['Prob %'], errors='coerce')
+            df['Prob %'] = pd.to_numeric(df['Prob %'], errors='coerce').astype('float32')
 
         date_cols = ['Data de abertura', 'Data fechamento']
         for col in date_cols:
-            df[col] = pd.to_datetime(df[col], errors='coerce', format='%d/%m/%Y %H:%M:%S')
+            raw = df[col]
+            parsed = pd.to_datetime(raw, errors='coerce', format='%d/%m/%Y %H:%M:%S', cache=True)
+            # Cells typed by hand occasionally drop the time part; give those
+            # the slow dayfirst parser instead of coercing them to NaT.
+            leftover = parsed.isna() & raw.astype(bool)
+            if leftover.any():
+                parsed.loc[leftover] = pd.to_datetime(
+                    raw[leftover], errors='coerce', dayfirst=True, cache=True
+                )
+            df[col] = parsed
+            df[f'{col}_fmt'] = df[col].dt.strftime('%d/%m/%Y %H:%M:%S').fillna('N/A')
 
-        df['OC_Identifier'] = df['Título'].apply(_extract_oc_identifier)
+        df['OC_Identifier'] = (
+            df['Título']
+            .astype('string')
+            .str.extract(_OC_PATTERN, expand=False)
+            .str.replace(' ', '', regex=False)
+        )
+
+        for col in ['Estado', 'Responsável', 'Estágio', 'OC_Identifier', 'Origem']:
+            if col in df.columns:
+                df[col] = df[col].astype('category')
 
         for col, attr in [('Data de abertura', 'MonthYear_Abertura'), ('Data fechamento', 'MonthYear_Fechamento')]:
-            df[attr] = df[col].dt.to_period('M') if pd.api.types.is_datetime64_any_dtype(df[col]) else None
+            if pd.api.types.is_datetime64_any_dtype(df[col]):
+                df[attr] = (df[col].dt.year * 100 + df[col].dt.month).astype('Int32')
+            else:
+                df[attr] = None
 
-        df['Hour_of_Day_Abertura'] = df['Data de abertura'].apply(lambda x: x.hour if pd.notna(x) else -1).astype(int)
+        df['Hour_of_Day_Abertura'] = df['Data de abertura'].dt.hour.fillna(-1).astype('int8')
 
-        df_timeline = df[['OC_Identifier', 'Estágio', 'Data de abertura', 'Data fechamento']].copy()
+        df_timeline = df[
+            ['OC_Identifier', 'Estágio', 'Data de abertura', 'Data fechamento', 'Hour_of_Day_Abertura']
+        ].copy()
         df_timeline.dropna(subset=['OC_Identifier', 'Data de abertura'], inplace=True)
-        df_timeline = df_timeline.sort_values(by=['OC_Identifier', 'Data de abertura'])
-
-        current_time = pd.to_datetime('now')
-        df_timeline['Time_in_Stage'] = (
-            df_timeline['Data fechamento'] - df_timeline['Data de abertura']
-        ).dt.total_seconds() / 3600
-        df_timeline['Time_in_Stage'] = df_timeline.apply(
-            lambda row: (current_time - row['Data de abertura']).total_seconds() / 3600
-            if pd.isna(row['Data fechamento'])
-            else row['Time_in_Stage'],
-            axis=1,
-        )
-        df_timeline['Tempo no Estágio'] = df_timeline['Time_in_Stage'].apply(format_time_in_stage)
 
+        now_ns = np.int64(pd.Timestamp.now().value)
+        fechamento = df_timeline['Data fechamento'].to_numpy('datetime64[ns]')
+        finish = np.where(np.isnat(fechamento), now_ns, fechamento.view('i8')).view('datetime64[ns]')
+        start = df_timeline['Data de abertura'].to_numpy('datetime64[ns]')
+        df_timeline['Time_in_Stage'] = ((finish.view('i8') - start.view('i8')) / 3.6e12).astype('float32')
+        df_timeline['Tempo no Estágio'] = format_time_in_stage_bulk(df_timeline['Time_in_Stage'])
+
+        _write_snapshot(df, df_timeline)
         return df, df_timeline
     except Exception as exc:  # pragma: no cover
         st.error(f"Erro ao carregar dados do Google Sheet: {exc}")
         return pd.DataFrame(), pd.DataFrame()
 
 
+@st.cache_data(show_spinner=False)
+def load_filter_options(df: pd.DataFrame) -> dict:
+    """Sorted option lists for the sidebar filters, fixed per sheet load."""
+    options = {}
+    for col in ['Estado', 'Responsável', 'Estágio']:
+        if col not in df.columns:
+            options[col] = []
+        elif isinstance(df[col].dtype, pd.CategoricalDtype):
+            options[col] = sorted(df[col].cat.categories.dropna().tolist())
+        else:
+            options[col] = sorted(df[col].dropna().unique().tolist())
+    return options
+
+
+_MAX_BAR_CATEGORIES = 30
+
+
+def _cap_top_n(frame: pd.DataFrame, label_col: str, value_col: str, n: int = _MAX_BAR_CATEGORIES) -> pd.DataFrame:
+    if len(frame) <= n:
+        return frame
+    ordered = frame.sort_values(value_col, ascending=False)
+    top = ordered.head(n)
+    other = pd.DataFrame({label_col: ['Outros'], value_col: [ordered[value_col].iloc[n:].sum()]})
+    return pd.concat([top.astype({label_col: object}), other], ignore_index=True)
+
+
+@st.cache_data(show_spinner=False)
+def filter_panel_df(
+    df: pd.DataFrame,
+    start_dt: pd.Timestamp | None,
+    end_dt: pd.Timestamp | None,
+    estados: tuple,
+    responsaveis: tuple,
+    estagios: tuple,
+) -> pd.DataFrame:
+    """Filtered slice of the main frame, cached per filter selection.
+
+    Reruns that leave the sidebar untouched skip the mask build and the
+    row copy entirely; the OC filter stays outside because its options
+    cascade from this result.
+    """
+    mask = pd.Series(True, index=df.index)
+    if start_dt is not None:
+        mask &= df['Data de abertura'].between(start_dt, end_dt)
+    if estados:
+        mask &= df['Estado'].isin(estados)
+    if responsaveis:
+        mask &= df['Responsável'].isin(responsaveis)
+    if estagios:
+        mask &= df['Estágio'].isin(estagios)
+    if mask.all():
+        return df
+    return df.loc[mask]
+
+
+def _unique_rows(frame: pd.DataFrame) -> pd.DataFrame:
+    """Row dedup via one uint64 hash pass instead of a multi-column key build."""
+    row_hash = pd.util.hash_pandas_object(frame, index=False)
+    return frame[~row_hash.duplicated().to_numpy()]
+
+
+@st.cache_data(show_spinner=False)
+def compute_panel_aggregates(filtered_df: pd.DataFrame) -> dict:
+    """Aggregations behind the Painel Geral charts, cached per filtered frame.
+
+    Unique-opportunity counts are not additive across filter buckets, so these
+    cannot be pre-aggregated at load time; caching per filter selection keeps
+    reruns with unchanged filters free of groupby work.
+    """
+    # One global dedup + size beats nunique's per-group hash sets.
+    agg_responsavel = (
+        _unique_rows(filtered_df[['Responsável', 'OC_Identifier']].dropna(subset=['OC_Identifier']))
+        .groupby('Responsável', observed=True)
+        .size()
+        .reset_index(name='Total Oportunidades Únicas')
+    )
+
+    agg_estado_mes = (
+        _unique_rows(
+            filtered_df[['Estado', 'MonthYear_Abertura', 'OC_Identifier']].dropna(subset=['OC_Identifier'])
+        )
+        .groupby(['Estado', 'MonthYear_Abertura'], observed=True)
+        .size()
+        .reset_index(name='Total Oportunidades Únicas')
+    )
+    year_month = agg_estado_mes['MonthYear_Abertura']
+    agg_estado_mes['MonthYear_Abertura'] = (
+        (year_month // 100).astype(str) + '-' + (year_month % 100).astype(str).str.zfill(2)
+    )
+
+    stage_counts = filtered_df['Estágio'].value_counts().reset_index()
+    stage_counts.columns = ['Estágio', 'Quantidade']
+    # value_counts over a categorical reports every category; keep only observed ones.
+    stage_counts = stage_counts[stage_counts['Quantidade'] > 0]
+
+    return {
+        "responsavel": _cap_top_n(agg_responsavel, 'Responsável', 'Total Oportunidades Únicas'),
+        "estado_mes": agg_estado_mes,
+        "stage_counts": _cap_top_n(stage_counts, 'Estágio', 'Quantidade'),
+    }
+
+
+@st.cache_data(show_spinner=False)
+def compute_panel_kpis(filtered_df: pd.DataFrame) -> dict:
+    """Scalar KPIs for the Resumo Geral cards, cached per filtered frame.
+
+    Under presentation-mode autorefresh the page reruns every 15s with
+    identical filters; caching turns those reruns into a lookup.
+    """
+    ganha_mask = filtered_df['Estado'].eq('Ganha')
+    total_ops = filtered_df['OC_Identifier'].nunique() if not filtered_df.empty else 0
+    unique_won = filtered_df.loc[ganha_mask, 'OC_Identifier'].nunique() if ganha_mask.any() else 0
+    valor_rec = filtered_df['Valor rec. fechamento']
+    won_values = valor_rec.where(valor_rec.notna(), filtered_df['Valor'])
+    total_won_value = won_values[ganha_mask].sum()
+    win_rate = (unique_won / total_ops * 100) if total_ops else 0
+    pipeline_mask = ~(ganha_mask | filtered_df['Estado'].eq('Perdida'))
+    valor_pipeline = filtered_df.loc[pipeline_mask, 'Valor'].sum(min_count=1)
+    valor_previsto = (
+        (filtered_df['Valor'] * (filtered_df['Prob %'] / 100)).sum(min_count=1)
+        if 'Prob %' in filtered_df.columns
+        else 0
+    )
+    ticket_medio = total_won_value / unique_won if unique_won else 0
+    return {
+        "total_ops": int(total_ops),
+        "win_rate": win_rate,
+        "total_won_value": total_won_value,
+        "ticket_medio": ticket_medio,
+        "valor_pipeline": valor_pipeline,
+        "valor_previsto": valor_previsto,
+    }
+
+
+@st.cache_data(show_spinner=False)
+def load_opportunity_timeline(df_timeline: pd.DataFrame, selected_oc: str) -> pd.DataFrame:
+    """Timeline rows for one opportunity, cached so unrelated widget reruns skip the scan."""
+    rows = df_timeline[df_timeline['OC_Identifier'] == selected_oc]
+    return rows.sort_values(by='Data de abertura')
+
+
+@st.cache_data(show_spinner=False)
+def load_home_kpis(df: pd.DataFrame) -> dict:
+    if df is None or df.empty:
+        total_ops, total_valor, win_rate = 0, 0.0, 0.0
+    else:
+        per_state = df.groupby('Estado', sort=False, observed=True)['OC_Identifier'].nunique()
+        total_ops = int(df['OC_Identifier'].nunique())
+        won_ops = int(per_state.get('Ganha', 0))
+        total_valor = df['Valor'].sum(min_count=1)
+        win_rate = 100.0 * won_ops / total_ops if total_ops else 0.0
+    return {
+        "total_ops": total_ops,
+        "total_valor": total_valor,
+        "win_rate": win_rate,
+        "total_ops_str": str(total_ops),
+        "total_valor_str": format_currency(total_valor),
+        "win_rate_str": safe_percentage(win_rate),
+    }
+
+
 def get_placeholder_interactions() -> pd.DataFrame:
     data = {
         'Usuário': ['User A', 'User B', 'User C', 'User A', 'User B', 'User D', 'User A'],
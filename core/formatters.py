@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import re
 from typing import Optional
 
 import pandas as pd
@@ -14,21 +15,40 @@ def format_currency(value: Optional[float]) -> str:
 def safe_percentage(value: Optional[float]) -> str:
     if value is None or pd.isna(value):
         return "0,0%"
-    return f"{value:.1f}%"
+    return f"{value:.1f}%".replace(".", ",")
+
+
+# Strips currency symbols, spaces and pt-BR thousands dots in one pass;
+# only digits, the decimal comma and the sign survive.
+_CURRENCY_JUNK = re.compile(r"[^\d,\-]")
 
 
 def normalize_currency(series: pd.Series) -> pd.Series:
     cleaned = (
         series.astype(str)
-        .str.replace("R$", "", regex=False)
-        .str.replace(" ", "", regex=False)
-        .str.replace(r"[^\d,.-]", "", regex=True)
-        .str.replace(".", "", regex=False)
+        .str.replace(_CURRENCY_JUNK, "", regex=True)
         .str.replace(",", ".", regex=False)
     )
     return pd.to_numeric(cleaned, errors="coerce")
 
 
+def format_time_in_stage_bulk(hours: pd.Series) -> pd.Series:
+    total_minutes = (hours * 60).fillna(-1).astype("int64")
+    days = total_minutes // (24 * 60)
+    remaining_minutes_after_days = total_minutes % (24 * 60)
+    hrs = remaining_minutes_after_days // 60
+    minutes = remaining_minutes_after_days % 60
+    formatted = (
+        days.astype(str)
+        + " dias, "
+        + hrs.astype(str)
+        + " horas, "
+        + minutes.astype(str)
+        + " minutos"
+    )
+    return formatted.where(hours.notna(), "N/A")
+
+
 def format_time_in_stage(hours: Optional[float]) -> str:
     if pd.isna(hours):
         return "N/A"
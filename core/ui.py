@@ -3,8 +3,44 @@ from __future__ import annotations
 from contextlib import contextmanager
 from typing import Optional
 
+import plotly.graph_objects as go
+import plotly.io as pio
 import streamlit as st
 
+# Registered once at import; figures then reference the templates by name instead
+# of receiving the full layout dict on every render.
+pio.templates["b2_card"] = go.layout.Template(
+    layout=go.Layout(
+        plot_bgcolor="rgba(5,10,25,0.6)",
+        paper_bgcolor="rgba(5,10,25,0.6)",
+        font=dict(family="Space Grotesk", color="#f8fafc"),
+        margin=dict(t=50, b=40, l=40, r=24),
+        xaxis=dict(gridcolor="rgba(148,163,184,0.3)"),
+        yaxis=dict(gridcolor="rgba(148,163,184,0.2)"),
+    )
+)
+
+pio.templates["b2_heatmap"] = go.layout.Template(
+    layout=go.Layout(
+        plot_bgcolor="rgba(5,10,25,0.35)",
+        paper_bgcolor="rgba(5,10,25,0.35)",
+        font=dict(family="Space Grotesk", color="#f8fafc"),
+        margin=dict(t=60, b=50, l=80, r=60),
+        xaxis=dict(
+            gridcolor="rgba(148,163,184,0.25)",
+            zerolinecolor="rgba(148,163,184,0.25)",
+            title_font=dict(color="#f8fafc"),
+            tickfont=dict(color="#cbd5f5"),
+        ),
+        yaxis=dict(
+            gridcolor="rgba(148,163,184,0.1)",
+            zerolinecolor="rgba(148,163,184,0.1)",
+            title_font=dict(color="#f8fafc"),
+            tickfont=dict(color="#cbd5f5"),
+        ),
+    )
+)
+
 
 def inject_global_styles() -> None:
     st.markdown(
@@ -113,6 +149,33 @@ def inject_global_styles() -> None:
                 filter: brightness(1.1);
             }
 
+            [data-testid="stMetric"] {
+                background: linear-gradient(135deg, rgba(56,189,248,0.12), rgba(99,102,241,0.15));
+                padding: 18px;
+                border-radius: 18px;
+                border: 1px solid var(--border-color);
+                backdrop-filter: blur(12px);
+                box-shadow: 0 18px 40px rgba(2,6,23,0.45);
+            }
+
+            [data-testid="stMetricLabel"] {
+                font-size: 0.85rem;
+                color: var(--text-muted);
+                letter-spacing: 0.08em;
+            }
+
+            [data-testid="stMetricValue"] {
+                font-size: 1.6rem;
+                font-weight: 600;
+                color: #f8fafc;
+            }
+
+            .kpi-grid {
+                display: grid;
+                grid-template-columns: repeat(3, 1fr);
+                gap: 12px;
+            }
+
             .metric-card {
                 background: linear-gradient(135deg, rgba(56,189,248,0.12), rgba(99,102,241,0.15));
                 color: #f8fafc;
@@ -174,40 +237,14 @@ def chart_card(title: Optional[str] = None, subtitle: Optional[str] = None):
 
 
 def style_fig(fig, height: Optional[int] = None):
-    fig.update_layout(
-        template="plotly_dark",
-        plot_bgcolor="rgba(5,10,25,0.6)",
-        paper_bgcolor="rgba(5,10,25,0.6)",
-        font=dict(family="Space Grotesk", color="#f8fafc"),
-        margin=dict(t=50, b=40, l=40, r=24),
-    )
-    fig.update_xaxes(gridcolor="rgba(148,163,184,0.3)")
-    fig.update_yaxes(gridcolor="rgba(148,163,184,0.2)")
+    fig.update_layout(template="plotly_dark+b2_card")
     if height:
         fig.update_layout(height=height)
     return fig
 
 
 def style_heatmap(fig, height: Optional[int] = None):
-    fig.update_layout(
-        template="plotly_dark",
-        plot_bgcolor="rgba(5,10,25,0.35)",
-        paper_bgcolor="rgba(5,10,25,0.35)",
-        font=dict(family="Space Grotesk", color="#f8fafc"),
-        margin=dict(t=60, b=50, l=80, r=60),
-    )
-    fig.update_xaxes(
-        gridcolor="rgba(148,163,184,0.25)",
-        zerolinecolor="rgba(148,163,184,0.25)",
-        title_font=dict(color="#f8fafc"),
-        tickfont=dict(color="#cbd5f5"),
-    )
-    fig.update_yaxes(
-        gridcolor="rgba(148,163,184,0.1)",
-        zerolinecolor="rgba(148,163,184,0.1)",
-        title_font=dict(color="#f8fafc"),
-        tickfont=dict(color="#cbd5f5"),
-    )
+    fig.update_layout(template="plotly_dark+b2_heatmap")
     if height:
         fig.update_layout(height=height)
     return fig
@@ -2,13 +2,22 @@ from __future__ import annotations
 
 from datetime import datetime
 
+import numpy as np
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 import streamlit as st
 
 from core.auth import require_auth
-from core.data_service import load_datasets
+from core.data_service import (
+    clear_snapshot,
+    compute_panel_aggregates,
+    compute_panel_kpis,
+    filter_panel_df,
+    load_datasets,
+    load_filter_options,
+    load_opportunity_timeline,
+)
 from core.formatters import format_currency, safe_percentage
 from core.ui import chart_card, style_fig, style_heatmap
 
@@ -18,6 +27,8 @@ except ImportError:  # pragma: no cover
     st_autorefresh = None
 
 
+_END_OF_DAY = pd.Timedelta(days=1) - pd.Timedelta(seconds=1)
+
 PLOTLY_CONFIG = {
     "displaylogo": False,
     "modeBarButtonsToRemove": ["zoomIn2d", "zoomOut2d", "lasso2d", "select2d"],
@@ -25,11 +36,22 @@ PLOTLY_CONFIG = {
 }
 
 
-def sidebar_multiselect(label: str, series: pd.Series):
-    options = sorted(series.dropna().unique().tolist())
+def _format_avg_hours_bulk(hours: pd.Series) -> pd.Series:
+    days = (hours // 24).fillna(-1).astype("int64")
+    rem = (hours % 24).fillna(-1).astype("int64")
+    formatted = days.astype(str) + " dias, " + rem.astype(str) + " horas"
+    return formatted.where(hours.notna(), "N/A")
+
+
+def sidebar_multiselect(label: str, options: list):
     if not options:
         return []
-    return st.sidebar.multiselect(label, options, default=options)
+    selection = st.sidebar.multiselect(label, options, default=options)
+    # Everything selected means no narrowing; returning [] lets the
+    # filter step skip the isin scan and keeps the cache key stable.
+    if len(selection) == len(options):
+        return []
+    return selection
 
 
 def get_filters(df: pd.DataFrame):
@@ -37,6 +59,7 @@ def get_filters(df: pd.DataFrame):
     
     # Botão para atualizar dados
     if st.sidebar.button("🔄 Atualizar Dados do Google Sheets", use_container_width=True, type="primary"):
+        clear_snapshot()
         st.cache_data.clear()
         st.cache_resource.clear()
         st.success("Cache limpo! Os dados serão recarregados.")
@@ -62,39 +85,41 @@ def get_filters(df: pd.DataFrame):
         if start_date > end_date:
             st.sidebar.warning("A data inicial era maior que a final e foi ajustada automaticamente.")
             start_date, end_date = end_date, start_date
-        start_datetime = pd.to_datetime(start_date)
-        end_datetime = pd.to_datetime(end_date) + pd.Timedelta(days=1) - pd.Timedelta(seconds=1)
-        filtered_df = df[
-            (df['Data de abertura'] >= start_datetime)
-            & (df['Data de abertura'] <= end_datetime)
-        ].copy()
+        start_datetime = pd.Timestamp(start_date)
+        end_datetime = pd.Timestamp(end_date) + _END_OF_DAY
     else:
-        start_datetime = pd.Timestamp("1970-01-01")
-        end_datetime = pd.Timestamp("2100-01-01")
-        filtered_df = df.copy()
+        start_datetime = None
+        end_datetime = None
+
+    filter_options = load_filter_options(df)
 
-    estados = sidebar_multiselect("Selecionar Estado", filtered_df['Estado'])
-    if estados:
-        filtered_df = filtered_df[filtered_df['Estado'].isin(estados)]
+    estados = sidebar_multiselect("Selecionar Estado", filter_options['Estado'])
+    responsaveis = sidebar_multiselect("Selecionar Responsável", filter_options['Responsável'])
+    estagios = sidebar_multiselect("Selecionar Estágio", filter_options['Estágio'])
 
-    responsaveis = sidebar_multiselect("Selecionar Responsável", filtered_df['Responsável'])
-    if responsaveis:
-        filtered_df = filtered_df[filtered_df['Responsável'].isin(responsaveis)]
+    partial_df = filter_panel_df(
+        df,
+        start_datetime,
+        end_datetime,
+        tuple(estados),
+        tuple(responsaveis),
+        tuple(estagios),
+    )
 
-    estagios = sidebar_multiselect("Selecionar Estágio", filtered_df['Estágio'])
     if estagios:
-        filtered_df = filtered_df[filtered_df['Estágio'].isin(estagios)]
         estagios_para_filtrar = estagios
     else:
-        estagios_para_filtrar = filtered_df['Estágio'].dropna().unique().tolist()
+        estagios_para_filtrar = partial_df['Estágio'].dropna().unique().tolist()
 
-    opportunity_identifiers = filtered_df['OC_Identifier'].dropna().unique()
+    opportunity_identifiers = partial_df['OC_Identifier'].dropna().unique()
     selected_oc = st.sidebar.selectbox(
         "Filtrar por Oportunidade (OC ou CTE)",
         ["Todos"] + list(opportunity_identifiers),
     )
     if selected_oc != "Todos":
-        filtered_df = filtered_df[filtered_df['OC_Identifier'] == selected_oc].copy()
+        filtered_df = partial_df[partial_df['OC_Identifier'] == selected_oc]
+    else:
+        filtered_df = partial_df
 
     presentation_mode = st.sidebar.toggle("Modo Apresentação", value=False)
     presentation_step = 0
@@ -113,50 +138,27 @@ def get_filters(df: pd.DataFrame):
 
 
 def render_kpis(filtered_df: pd.DataFrame):
-    ganha_df = filtered_df[filtered_df['Estado'] == 'Ganha'].copy()
-    total_ops = filtered_df['OC_Identifier'].nunique() if not filtered_df.empty else 0
-    unique_won = ganha_df['OC_Identifier'].nunique() if not ganha_df.empty else 0
-    won_values = ganha_df['Valor rec. fechamento'].where(
-        ganha_df['Valor rec. fechamento'].notna(), ganha_df['Valor']
-    )
-    total_won_value = won_values.sum() if won_values is not None else 0
-    win_rate = (unique_won / total_ops * 100) if total_ops else 0
-    pipeline_mask = ~filtered_df['Estado'].isin(['Ganha', 'Perdida'])
-    valor_pipeline = filtered_df.loc[pipeline_mask, 'Valor'].sum(min_count=1)
-    valor_previsto = (
-        (filtered_df['Valor'] * (filtered_df['Prob %'] / 100)).sum(min_count=1)
-        if 'Prob %' in filtered_df.columns
-        else 0
-    )
-    ticket_medio = total_won_value / unique_won if unique_won else 0
+    kpis = compute_panel_kpis(filtered_df)
 
     kpi_data = [
-        ("Total Oportunidades Únicas", f"{int(total_ops)}"),
-        ("Taxa de Sucesso", safe_percentage(win_rate)),
-        ("Valor Total Ganho", format_currency(total_won_value)),
-        ("Ticket Médio Ganho", format_currency(ticket_medio)),
-        ("Valor em Aberto", format_currency(valor_pipeline)),
-        ("Valor Previsto (Prob %)", format_currency(valor_previsto)),
+        ("Total Oportunidades Únicas", f"{kpis['total_ops']}"),
+        ("Taxa de Sucesso", safe_percentage(kpis['win_rate'])),
+        ("Valor Total Ganho", format_currency(kpis['total_won_value'])),
+        ("Ticket Médio Ganho", format_currency(kpis['ticket_medio'])),
+        ("Valor em Aberto", format_currency(kpis['valor_pipeline'])),
+        ("Valor Previsto (Prob %)", format_currency(kpis['valor_previsto'])),
     ]
 
     with chart_card("Resumo Geral"):
-        cols = st.columns(3)
-        for idx, (label, value) in enumerate(kpi_data):
-            with cols[idx % 3]:
-                st.markdown(
-                    f"<div class='metric-card'><h3>{label}</h3><p>{value}</p></div>",
-                    unsafe_allow_html=True,
-                )
-
+        cards = "".join(
+            f"<div class='metric-card'><h3>{label}</h3><p>{value}</p></div>"
+            for label, value in kpi_data
+        )
+        st.markdown(f"<div class='kpi-grid'>{cards}</div>", unsafe_allow_html=True)
 
-def main():
-    require_auth()
-    df, df_timeline = load_datasets()
-
-    if df.empty:
-        st.warning("Dados indisponíveis. Verifique a conexão com o Google Sheets.")
-        return
 
+@st.fragment
+def render_painel(df: pd.DataFrame, df_timeline: pd.DataFrame):
     filtered_df, start_dt, end_dt, estagios_para_filtrar, selected_oc, presentation_step = get_filters(df)
     if filtered_df.empty:
         st.warning("Sem dados para os filtros aplicados.")
@@ -167,16 +169,9 @@ def main():
     st.subheader("Análise de Oportunidades e Valor")
     col1, col2 = st.columns(2)
 
-    df_agg_responsavel = filtered_df.groupby('Responsável')['OC_Identifier'].nunique().reset_index()
-    df_agg_responsavel.rename(columns={'OC_Identifier': 'Total Oportunidades Únicas'}, inplace=True)
-
-    df_agg_estado_mes = (
-        filtered_df.groupby(['Estado', 'MonthYear_Abertura'])['OC_Identifier']
-        .nunique()
-        .reset_index()
-    )
-    df_agg_estado_mes.rename(columns={'OC_Identifier': 'Total Oportunidades Únicas'}, inplace=True)
-    df_agg_estado_mes['MonthYear_Abertura'] = df_agg_estado_mes['MonthYear_Abertura'].astype(str)
+    aggregates = compute_panel_aggregates(filtered_df)
+    df_agg_responsavel = aggregates["responsavel"]
+    df_agg_estado_mes = aggregates["estado_mes"]
 
     with col1:
         with chart_card("Responsáveis com mais Oportunidades"):
@@ -188,9 +183,9 @@ def main():
                     color='Responsável',
                     color_discrete_sequence=px.colors.qualitative.Set2,
                 )
-                fig1.update_layout(xaxis_title="Responsável", yaxis_title="Total de Oportunidades Únicas")
+                fig1.update_layout(xaxis_title="Responsável", yaxis_title="Total de Oportunidades Únicas", uirevision="resp")
                 style_fig(fig1)
-                st.plotly_chart(fig1, use_container_width=True, config=PLOTLY_CONFIG)
+                st.plotly_chart(fig1, use_container_width=True, config=PLOTLY_CONFIG, key="resp_chart")
             else:
                 st.info("Sem dados para responsáveis dentro dos filtros atuais.")
 
@@ -205,36 +200,40 @@ def main():
                     barmode='group',
                     color_discrete_sequence=px.colors.qualitative.Pastel,
                 )
-                fig2.update_layout(xaxis_title="Mês/Ano", yaxis_title="Total de Oportunidades Únicas")
+                fig2.update_layout(xaxis_title="Mês/Ano", yaxis_title="Total de Oportunidades Únicas", uirevision="estado_mes")
                 style_fig(fig2)
-                st.plotly_chart(fig2, use_container_width=True, config=PLOTLY_CONFIG)
+                st.plotly_chart(fig2, use_container_width=True, config=PLOTLY_CONFIG, key="estado_mes_chart")
             else:
                 st.info("Sem dados por estado e mês para os filtros atuais.")
 
+    # Both timeline cards share the same slice; filter it once per render
+    # with a single fused mask so only one subset frame is materialized.
+    if df_timeline.empty:
+        df_timeline_filtered = df_timeline
+    else:
+        if selected_oc != "Todos":
+            # One opportunity is a handful of rows; start from the cached
+            # per-OC slice so the remaining masks scan that, not the full frame.
+            base = load_opportunity_timeline(df_timeline, selected_oc)
+        else:
+            base = df_timeline
+        timeline_mask = base['Data de abertura'].between(start_dt, end_dt)
+        if estagios_para_filtrar:
+            timeline_mask &= base['Estágio'].isin(estagios_para_filtrar)
+        df_timeline_filtered = base.loc[timeline_mask]
+
     with chart_card("Heatmap: Oportunidades por Etapa e Hora de Abertura"):
         if df_timeline.empty:
             st.info("Timeline indisponível.")
         else:
-            df_timeline_filtered = df_timeline[
-                (df_timeline['Data de abertura'] >= start_dt)
-                & (df_timeline['Data de abertura'] <= end_dt)
-            ].copy()
-            if estagios_para_filtrar:
-                df_timeline_filtered = df_timeline_filtered[
-                    df_timeline_filtered['Estágio'].isin(estagios_para_filtrar)
-                ].copy()
-            if selected_oc != "Todos":
-                df_timeline_filtered = df_timeline_filtered[
-                    df_timeline_filtered['OC_Identifier'] == selected_oc
-                ].copy()
-
             if df_timeline_filtered.empty:
                 st.info("Sem timeline para os filtros atuais.")
             else:
-                df_timeline_filtered['Hour_of_Day_Abertura'] = df_timeline_filtered['Data de abertura'].dt.hour
                 heatmap_data = (
-                    df_timeline_filtered.groupby(['Estágio', 'Hour_of_Day_Abertura'])['OC_Identifier']
-                    .nunique()
+                    df_timeline_filtered[['Estágio', 'Hour_of_Day_Abertura', 'OC_Identifier']]
+                    .drop_duplicates()
+                    .groupby(['Estágio', 'Hour_of_Day_Abertura'], observed=True)
+                    .size()
                     .unstack(fill_value=0)
                 )
                 if heatmap_data.empty:
@@ -242,11 +241,11 @@ def main():
                 else:
                     fig_heatmap = go.Figure(
                         data=go.Heatmap(
-                            z=heatmap_data.values,
+                            z=heatmap_data.values.astype(np.int16),
                             x=heatmap_data.columns,
                             y=heatmap_data.index,
                             colorscale='Portland',
-                            zsmooth='best',
+                            zsmooth=False,
                             colorbar=dict(
                                 title=dict(text='Qtd. de Oportunidades', font=dict(color='#f8fafc')),
                                 thickness=12,
@@ -260,14 +259,14 @@ def main():
                         title='Oportunidades por Etapa e Hora de Abertura',
                         xaxis_title='Hora do Dia',
                         yaxis_title='Etapa',
+                        uirevision='heatmap',
                     )
                     style_heatmap(fig_heatmap)
-                    st.plotly_chart(fig_heatmap, use_container_width=True, config=PLOTLY_CONFIG)
+                    st.plotly_chart(fig_heatmap, use_container_width=True, config=PLOTLY_CONFIG, key="heatmap_chart")
 
     st.subheader("Análise de Estágios")
     with chart_card("Distribuição de Todos os Estágios (Filtrado)"):
-        stage_counts = filtered_df['Estágio'].value_counts().reset_index()
-        stage_counts.columns = ['Estágio', 'Quantidade']
+        stage_counts = aggregates["stage_counts"]
         if stage_counts.empty:
             st.info("Sem dados de estágio para os filtros atuais.")
         else:
@@ -278,35 +277,20 @@ def main():
                 color='Estágio',
                 color_discrete_sequence=px.colors.qualitative.Set3,
             )
-            fig4.update_layout(xaxis_title="Estágio", yaxis_title="Quantidade")
+            fig4.update_layout(xaxis_title="Estágio", yaxis_title="Quantidade", uirevision="estagio_dist")
             style_fig(fig4)
-            st.plotly_chart(fig4, use_container_width=True, config=PLOTLY_CONFIG)
+            st.plotly_chart(fig4, use_container_width=True, config=PLOTLY_CONFIG, key="estagio_dist_chart")
 
     with chart_card("Análise de Tempo Médio por Estágio (Filtrado)"):
         if df_timeline.empty:
             st.info("Timeline indisponível.")
         else:
-            df_timeline_avg = df_timeline[
-                (df_timeline['Data de abertura'] >= start_dt)
-                & (df_timeline['Data de abertura'] <= end_dt)
-            ].copy()
-            if estagios_para_filtrar:
-                df_timeline_avg = df_timeline_avg[df_timeline_avg['Estágio'].isin(estagios_para_filtrar)].copy()
-            if selected_oc != "Todos":
-                df_timeline_avg = df_timeline_avg[
-                    df_timeline_avg['OC_Identifier'] == selected_oc
-                ].copy()
-
-            if df_timeline_avg.empty:
+            if df_timeline_filtered.empty:
                 st.info("Sem dados para cálculo de tempo médio.")
             else:
-                df_agg_time = df_timeline_avg.groupby('Estágio')['Time_in_Stage'].mean().reset_index()
+                df_agg_time = df_timeline_filtered.groupby('Estágio', observed=True)['Time_in_Stage'].mean().reset_index()
                 df_agg_time = df_agg_time.sort_values(by='Time_in_Stage', ascending=False)
-                df_agg_time['Tempo Médio no Estágio'] = df_agg_time['Time_in_Stage'].apply(
-                    lambda hours: "N/A"
-                    if pd.isna(hours)
-                    else f"{int(hours // 24)} dias, {int(hours % 24)} horas"
-                )
+                df_agg_time['Tempo Médio no Estágio'] = _format_avg_hours_bulk(df_agg_time['Time_in_Stage'])
 
                 st.dataframe(df_agg_time[['Estágio', 'Tempo Médio no Estágio']])
                 fig5 = px.bar(
@@ -316,9 +300,9 @@ def main():
                     color='Estágio',
                     color_discrete_sequence=px.colors.qualitative.Vivid,
                 )
-                fig5.update_layout(xaxis_title='Estágio', yaxis_title='Tempo Médio (horas)')
+                fig5.update_layout(xaxis_title='Estágio', yaxis_title='Tempo Médio (horas)', uirevision='tempo_medio')
                 style_fig(fig5)
-                st.plotly_chart(fig5, use_container_width=True, config=PLOTLY_CONFIG)
+                st.plotly_chart(fig5, use_container_width=True, config=PLOTLY_CONFIG, key="tempo_medio_chart")
 
     if presentation_step == 1:
         st.success("Modo apresentação: destacando o Heatmap.")
@@ -326,5 +310,16 @@ def main():
         st.success("Modo apresentação: destacando a Análise de Tempo Médio.")
 
 
+def main():
+    require_auth()
+    df, df_timeline = load_datasets()
+
+    if df.empty:
+        st.warning("Dados indisponíveis. Verifique a conexão com o Google Sheets.")
+        return
+
+    render_painel(df, df_timeline)
+
+
 if __name__ == "__main__":
     main()
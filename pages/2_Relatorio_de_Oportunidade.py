@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import io
 import os
 from datetime import datetime
 
@@ -7,11 +8,12 @@ import pandas as pd
 import streamlit as st
 
 from core.auth import require_auth
-from core.data_service import load_datasets
+from core.data_service import clear_snapshot, load_datasets, load_opportunity_timeline
 from core.formatters import format_currency
 from core.ui import chart_card
 
 
+@st.cache_resource
 def get_openai_client():
     api_key = os.getenv("OPENAI_API_KEY") or st.secrets.get("openai", {}).get("api_key")
     if not api_key:
@@ -22,12 +24,30 @@ def get_openai_client():
     return openai.OpenAI(api_key=api_key)
 
 
+def _stream_ai(client, model: str, prompt: str):
+    stream = client.chat.completions.create(
+        model=model,
+        messages=[
+            {"role": "system", "content": "Você é um assistente de BI conciso e direto."},
+            {"role": "user", "content": prompt},
+        ],
+        max_tokens=300,
+        temperature=0,
+        stream=True,
+    )
+    for chunk in stream:
+        delta = chunk.choices[0].delta.content
+        if delta:
+            yield delta
+
+
 def main():
     require_auth()
     
     # Botão para atualizar dados
     st.sidebar.header("Ações")
     if st.sidebar.button("🔄 Atualizar Dados do Google Sheets", use_container_width=True, type="primary"):
+        clear_snapshot()
         st.cache_data.clear()
         st.cache_resource.clear()
         st.success("Cache limpo! Os dados serão recarregados.")
@@ -69,12 +89,10 @@ def main():
 
     col_dates1, col_dates2 = st.columns(2)
     with col_dates1:
-        abertura = opportunity.get('Data de abertura')
-        abertura_str = abertura.strftime('%d/%m/%Y %H:%M:%S') if pd.notna(abertura) else "N/A"
+        abertura_str = opportunity.get('Data de abertura_fmt', 'N/A')
         st.write("**Data de Abertura:**", abertura_str)
     with col_dates2:
-        fechamento = opportunity.get('Data fechamento')
-        fechamento_str = fechamento.strftime('%d/%m/%Y %H:%M:%S') if pd.notna(fechamento) else "N/A"
+        fechamento_str = opportunity.get('Data fechamento_fmt', 'N/A')
         st.write("**Data de Fechamento:**", fechamento_str)
 
     if pd.notna(opportunity.get('Data fechamento')):
@@ -85,13 +103,18 @@ def main():
             st.write("**Observação de Fechamento:**", opportunity.get('Observação de fechamento', 'N/A'))
 
     with chart_card("Linha do Tempo da Oportunidade"):
-        opportunity_timeline = df_timeline[df_timeline['OC_Identifier'] == selected_oc].copy()
+        opportunity_timeline = load_opportunity_timeline(df_timeline, selected_oc)
         if opportunity_timeline.empty:
             st.info("Nenhum dado de timeline encontrado para esta oportunidade.")
         else:
             display_cols = ['Estágio', 'Data de abertura', 'Data fechamento', 'Tempo no Estágio']
-            st.dataframe(opportunity_timeline[display_cols], use_container_width=True)
+            st.dataframe(opportunity_timeline, use_container_width=True, column_order=display_cols)
+
+    render_ai_assistant(opportunity, opportunity_timeline, abertura_str, fechamento_str)
+
 
+@st.fragment
+def render_ai_assistant(opportunity, opportunity_timeline, abertura_str, fechamento_str):
     st.subheader("Assistente de IA")
     client = get_openai_client()
     if not client:
@@ -103,35 +126,36 @@ def main():
         if not user_query:
             st.warning("Digite uma pergunta.")
         else:
-            with st.spinner("Analisando com IA..."):
-                prompt = f"""
-                Você é um analista de BI. Use os dados abaixo para responder em português.
-                Detalhes:
-                - ID: {opportunity.get('ID', 'N/A')}
-                - Título: {opportunity.get('Título', 'N/A')}
-                - Responsável: {opportunity.get('Responsável', 'N/A')}
-                - Estado: {opportunity.get('Estado', 'N/A')}
-                - Estágio: {opportunity.get('Estágio', 'N/A')}
-                - Valor: {format_currency(opportunity.get('Valor'))}
-                - Origem: {opportunity.get('Origem', 'N/A')}
-                - Prob %: {opportunity.get('Prob %', 'N/A')}
-                - OC: {opportunity.get('OC', 'N/A')}
-                - Data de Abertura: {abertura_str}
-                - Data de Fechamento: {fechamento_str}
-                Linha do tempo:
-                {opportunity_timeline[['Estágio', 'Data de abertura', 'Data fechamento', 'Tempo no Estágio']].to_string(index=False)}
-
-                Pergunta do usuário: {user_query}
-                """
-                response = client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=[
-                        {"role": "system", "content": "Você é um assistente de BI conciso e direto."},
-                        {"role": "user", "content": prompt},
-                    ],
-                    max_tokens=300,
-                )
-                st.success(response.choices[0].message.content)
+            buf = io.StringIO()
+            # Last 20 stages with short dates keep the prompt (and token bill) small.
+            opportunity_timeline[
+                ['Estágio', 'Data de abertura', 'Data fechamento', 'Tempo no Estágio']
+            ].tail(20).to_csv(buf, index=False, sep='|', date_format='%Y-%m-%d %H:%M')
+            detail_fields = [
+                'ID', 'Título', 'Responsável', 'Estado', 'Estágio',
+                'Valor', 'Origem', 'Prob %', 'OC',
+            ]
+            details = opportunity.reindex(detail_fields)
+            details['Valor'] = format_currency(details['Valor'])
+            details = details.fillna('N/A')
+            details_lines = [f"- {field}: {value}" for field, value in details.items()]
+            details_lines.append(f"- Data de Abertura: {abertura_str}")
+            details_lines.append(f"- Data de Fechamento: {fechamento_str}")
+            prompt = "\n".join(
+                [
+                    "Você é um analista de BI. Use os dados abaixo para responder em português.",
+                    "Detalhes:",
+                    *details_lines,
+                    "Linha do tempo (colunas separadas por |):",
+                    buf.getvalue(),
+                    f"Pergunta do usuário: {user_query}",
+                ]
+            )
+            answers = st.session_state.setdefault("ai_answers", {})
+            if prompt in answers:
+                st.success(answers[prompt])
+            else:
+                answers[prompt] = st.write_stream(_stream_ai(client, "gpt-4o-mini", prompt))
 
 
 if __name__ == "__main__":
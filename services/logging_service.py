@@ -1,30 +1,54 @@
 from __future__ import annotations
 
+import atexit
 import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from pathlib import Path
 
-_LOGGER: logging.Logger | None = None
+import streamlit as st
 
+_listener: QueueListener | None = None
 
+
+def _stop_listener() -> None:
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(_stop_listener)
+
+
+@st.cache_resource
 def get_logger() -> logging.Logger:
-    global _LOGGER
-    if _LOGGER:
-        return _LOGGER
+    global _listener
 
     logs_dir = Path("logs")
     logs_dir.mkdir(exist_ok=True)
     log_file = logs_dir / "app.log"
 
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(asctime)s | %(levelname)s | %(message)s",
-        handlers=[
-            logging.FileHandler(log_file, encoding="utf-8"),
-            logging.StreamHandler(),
-        ],
+    formatter = logging.Formatter("%(asctime)s | %(levelname)s | %(message)s")
+    file_handler = RotatingFileHandler(
+        log_file, maxBytes=5_000_000, backupCount=3, encoding="utf-8"
     )
-
-    _LOGGER = logging.getLogger("b2-bi")
-    _LOGGER.info("Logging configurado.")
-    return _LOGGER
-
+    file_handler.setFormatter(formatter)
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(formatter)
+
+    # Records are enqueued on the script thread and written by the listener
+    # thread, so log I/O never blocks a rerun. A cleared resource cache
+    # re-enters here, so the previous listener thread is stopped first.
+    _stop_listener()
+    log_queue: queue.Queue = queue.Queue(-1)
+    _listener = QueueListener(log_queue, file_handler, stream_handler)
+    _listener.start()
+
+    logger = logging.getLogger("b2-bi")
+    logger.setLevel(logging.INFO)
+    logger.handlers.clear()
+    logger.addHandler(QueueHandler(log_queue))
+    logger.propagate = False
+    logger.info("Logging configurado.")
+    return logger
@@ -1,6 +1,12 @@
 import pandas as pd
 
-from core.formatters import format_currency, format_time_in_stage, normalize_currency, safe_percentage
+from core.formatters import (
+    format_currency,
+    format_time_in_stage,
+    format_time_in_stage_bulk,
+    normalize_currency,
+    safe_percentage,
+)
 
 
 def test_format_currency():
@@ -25,3 +31,10 @@ def test_format_time_in_stage():
     assert "1 dias" in format_time_in_stage(24)
     assert format_time_in_stage(None) == "N/A"
 
+
+def test_format_time_in_stage_bulk_matches_scalar():
+    hours = pd.Series([24.0, 1.5, 0.0, None])
+    result = format_time_in_stage_bulk(hours)
+    expected = hours.apply(format_time_in_stage)
+    assert result.tolist() == expected.tolist()
+